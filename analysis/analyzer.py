@@ -7,13 +7,20 @@ Each new image is sent to Groq (Llama 4 Scout) for structural analysis.
 Results are POSTed to the Flask dashboard for real-time display.
 """
 
+import hashlib
+import io
 import json
+import mmap
 import os
-import re
 import sys
+import tempfile
+import threading
 import time
-import base64
 import requests
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from datetime import datetime
 from pathlib import Path
 
@@ -30,7 +37,33 @@ if sys.base_prefix == sys.prefix:
 from dotenv import load_dotenv
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from groq import Groq
+from groq import APIConnectionError, Groq, InternalServerError, RateLimitError
+
+from PIL import Image
+
+# imagehash is optional: without it the near-duplicate cache is disabled
+try:
+    import imagehash
+except ImportError:
+    imagehash = None
+
+# pybase64 uses SIMD (SSSE3/AVX2/NEON) kernels; fall back to the stdlib if absent
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# orjson parses/serializes large payloads much faster; fall back to the stdlib
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -44,10 +77,19 @@ if not GROQ_API_KEY or GROQ_API_KEY == "your_groq_api_key_here":
     print("[ERROR] Get a free key at https://console.groq.com/keys")
     sys.exit(1)
 
-client = Groq(api_key=GROQ_API_KEY)
+# Retries are handled by analyze_images; disable the SDK's own backoff loop
+client = Groq(api_key=GROQ_API_KEY, max_retries=0)
 
 DASHBOARD_URL = "http://localhost:5000/api/analysis"
+
+# Keep-alive session so dashboard POSTs reuse one connection
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0))
+
 IMAGE_DIR = os.path.join(os.path.dirname(__file__), "..", "inspection_images")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+CACHE_DIR = os.path.join(os.path.dirname(__file__), ".cache")
+PHASH_CACHE_PATH = os.path.join(CACHE_DIR, "phash_cache.jsonl")
 
 # Groq vision model – Llama 4 Scout (free tier: 30 RPM, 1000 RPD)
 MODEL_NAME = "meta-llama/llama-4-scout-17b-16e-instruct"
@@ -55,7 +97,32 @@ MODEL_NAME = "meta-llama/llama-4-scout-17b-16e-instruct"
 # Rate-limit handling
 MAX_RETRIES = 5
 DEFAULT_RETRY_DELAY = 10.0     # seconds – Groq limits are generous so shorter waits
-THROTTLE_BETWEEN_IMAGES = 3.0  # seconds between API calls (30 RPM = 1 every 2s)
+TRANSIENT_RETRY_DELAY = 1.0    # seconds, doubled per attempt for network/5xx errors
+RATE_LIMIT_CALLS = 30          # Groq free tier: 30 requests...
+RATE_LIMIT_PERIOD = 60.0       # ...per 60 seconds
+MAX_WORKERS = 8                # concurrent in-flight Groq requests
+
+# Batching: several images share one request (Llama 4 Scout accepts up to 5)
+BATCH_SIZE = 4                 # images per Groq request
+BATCH_IDLE_FLUSH = 2.0         # seconds without a new image before a partial batch is sent
+MAX_TOKENS_PER_IMAGE = 2048
+
+# Watcher: a new file is considered fully written once its size stops changing
+SETTLE_INTERVAL = 0.02         # seconds between size checks
+SETTLE_ROUNDS = 2              # consecutive unchanged checks required
+SETTLE_TIMEOUT = 2.0           # give up waiting after this long
+
+# Watcher: remember this many recently seen paths (bounded for long flights)
+MAX_TRACKED_PATHS = 4096
+
+# Request payload: larger images are downscaled and re-encoded before upload
+MAX_IMAGE_DIMENSION = 1280     # pixels, longest side
+PAYLOAD_JPEG_QUALITY = 85
+
+# Near-duplicate detection: consecutive frames along a strafe overlap heavily
+PHASH_SIZE = 16                # 16x16 perceptual hash = 256 bits
+PHASH_MAX_DISTANCE = 10        # Hamming distance (bits) below which frames are duplicates
+PHASH_MAX_ENTRIES = 1024       # most recent frames compared against (bounds lookups and memory)
 
 # ---------------------------------------------------------------------------
 # Structural Analysis Prompt
@@ -97,143 +164,401 @@ Return a JSON object with exactly this structure:
   "confidence_score": 0.85
 }"""
 
+BATCH_PROMPT_HEADER = """You will receive {count} photographs from the same inspection flight, in order. Analyze each photograph independently using the instructions below.
+
+Return a JSON object of the form {{"analyses": [...]}} where "analyses" contains exactly {count} objects, one per photograph in the order given. Each object must follow the per-photograph structure described below.
+
+"""
+
+# ---------------------------------------------------------------------------
+# Rate Limiting
+# ---------------------------------------------------------------------------
+
+class RateLimiter:
+    """Sliding-window limiter: at most ``max_calls`` acquisitions per ``period`` seconds."""
+
+    def __init__(self, max_calls: int, period: float):
+        self.max_calls = max_calls
+        self.period = period
+        self.calls = deque()   # timestamps of recent acquisitions
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a call is allowed, then record it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.calls and now - self.calls[0] >= self.period:
+                    self.calls.popleft()
+                if len(self.calls) < self.max_calls:
+                    self.calls.append(now)
+                    return
+                wait = self.period - (now - self.calls[0])
+            print(f"[THROTTLE] Rate limit reached – waiting {wait:.1f}s before next API call...")
+            time.sleep(wait)
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_CALLS, RATE_LIMIT_PERIOD)
+
 # ---------------------------------------------------------------------------
 # Image Analysis Function
 # ---------------------------------------------------------------------------
 
-def _parse_retry_delay(error_message: str) -> float:
-    """Try to extract the retry delay (in seconds) from a 429 error message."""
-    match = re.search(r"retry.after[:\s]*([\d.]+)", error_message, re.IGNORECASE)
-    if match:
-        return float(match.group(1))
-    match = re.search(r"try again in ([\d.]+)s", error_message, re.IGNORECASE)
-    if match:
-        return float(match.group(1))
-    return DEFAULT_RETRY_DELAY
+def _retry_delay(error: RateLimitError) -> float:
+    """Return the server-requested wait (Retry-After header) for a 429 response."""
+    try:
+        return float(error.response.headers.get("retry-after", DEFAULT_RETRY_DELAY))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_DELAY
+
 
+def _map_image(image_path: str) -> mmap.mmap:
+    """Memory-map an image file read-only.
 
-def _encode_image_base64(image_path: str) -> str:
-    """Read an image file and return its base64 encoding."""
+    The mapping supports both the buffer protocol (hashing) and the file
+    API (Pillow), so hashing and decoding read the file without an extra
+    copy. Close it as soon as those steps are done: the drone reuses
+    capture file names on every flight, and touching a mapping whose file
+    has been truncated kills the process with SIGBUS.
+    """
     with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Digest of everything besides the image that determines an analysis
+_PROMPT_DIGEST = hashlib.sha256((ANALYSIS_PROMPT + MODEL_NAME).encode()).hexdigest()
+
+
+def _cache_key(image_bytes) -> str:
+    """Key an analysis by image content, prompt and model so stale entries never match."""
+    h = hashlib.sha256(image_bytes)
+    h.update(ANALYSIS_PROMPT.encode())
+    h.update(MODEL_NAME.encode())
+    return h.hexdigest()
+
+
+def _load_cached_analysis(key: str):
+    """Return the cached analysis for ``key``, or None on a miss."""
+    cache_path = Path(CACHE_DIR, key + ".json")
+    if not cache_path.exists():
+        return None
+    try:
+        return _json_loads(cache_path.read_bytes())
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _atomic_write_json(path: str, obj):
+    """Write ``obj`` as JSON via a temp file + rename so readers never see partial data."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(_json_dumps(obj))
+    os.replace(tmp_path, path)
 
 
-def analyze_image(image_path: str) -> dict:
-    """Send an image to Groq (Llama 4 Scout) and return the structural analysis.
+def _store_cached_analysis(key: str, analysis: dict):
+    """Atomically write a successful analysis to the on-disk cache."""
+    try:
+        _atomic_write_json(os.path.join(CACHE_DIR, key + ".json"), analysis)
+    except OSError as e:
+        print(f"[WARN] Failed to write analysis cache: {e}")
+
 
-    Includes automatic retry with backoff for rate-limit (429) errors.
+class PerceptualHashCache:
+    """Near-duplicate cache: maps perceptual hashes of past frames to their analyses.
+
+    A frame whose hash is within ``PHASH_MAX_DISTANCE`` bits of one of the
+    last ``PHASH_MAX_ENTRIES`` stored frames reuses that analysis instead of
+    calling Groq. Only the exact-cache key of each analysis is kept; the
+    analysis itself is read from the exact cache on a hit. Entries are
+    persisted by appending one JSON line each and are tagged with the
+    prompt/model digest, so a prompt or model change invalidates them.
     """
-    image_b64 = _encode_image_base64(image_path)
 
-    # Determine MIME type
-    ext = os.path.splitext(image_path)[1].lower()
-    mime = {"jpg": "image/jpeg", ".jpg": "image/jpeg", ".jpeg": "image/jpeg",
-            ".png": "image/png"}.get(ext, "image/jpeg")
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = deque(maxlen=PHASH_MAX_ENTRIES)   # (ImageHash, cache key)
+        self.lock = threading.Lock()        # guards entries
+        self.file_lock = threading.Lock()   # serializes appends to the file
+        self._load()
+
+    def _load(self):
+        if imagehash is None or not os.path.exists(self.path):
+            return
+        lines = 0
+        try:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        item = _json_loads(line)
+                        if item["prompt"] == _PROMPT_DIGEST:
+                            self.entries.append((imagehash.hex_to_hash(item["phash"]), item["key"]))
+                    except (ValueError, KeyError, TypeError):
+                        continue   # skip a torn or foreign line
+        except OSError as e:
+            print(f"[WARN] Ignoring unreadable perceptual hash cache: {e}")
+            return
+        # The file only ever grows; rewrite it once it is mostly stale
+        if lines > 2 * PHASH_MAX_ENTRIES:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the file with just the retained entries."""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.writelines(self._record(h, key) for h, key in self.entries)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[WARN] Failed to compact perceptual hash cache: {e}")
+
+    @staticmethod
+    def _record(phash, key: str) -> bytes:
+        return _json_dumps({"phash": str(phash), "key": key, "prompt": _PROMPT_DIGEST}) + b"\n"
+
+    @staticmethod
+    def compute(image_file):
+        """Return the perceptual hash of an image file object, or None if unavailable."""
+        if imagehash is None:
+            return None
+        try:
+            with Image.open(image_file) as img:
+                return imagehash.phash(img, hash_size=PHASH_SIZE)
+        except OSError:
+            return None
+
+    def lookup(self, phash):
+        """Return the analysis of the closest stored frame if it is a near-duplicate."""
+        if phash is None:
+            return None
+        with self.lock:
+            best, best_distance = None, PHASH_MAX_DISTANCE
+            for stored, key in self.entries:
+                distance = phash - stored
+                if distance < best_distance:
+                    best, best_distance = key, distance
+        return _load_cached_analysis(best) if best else None
+
+    def add(self, phash, key: str):
+        """Remember that the frame with ``phash`` was analyzed under cache ``key``."""
+        if phash is None or not key:
+            return
+        with self.lock:
+            self.entries.append((phash, key))
+        try:
+            with self.file_lock:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "ab") as f:
+                    f.write(self._record(phash, key))
+        except OSError as e:
+            print(f"[WARN] Failed to write perceptual hash cache: {e}")
+
+
+phash_cache = PerceptualHashCache(PHASH_CACHE_PATH)
+
+
+def _shrink_image(image_data: mmap.mmap) -> bytes:
+    """Return JPEG bytes no larger than ``MAX_IMAGE_DIMENSION`` on either side.
+
+    JPEGs that already fit are copied out untouched; anything else is
+    downscaled and re-encoded. Either way the result no longer references
+    the mapping. The file on disk is never modified.
+    """
+    try:
+        with Image.open(image_data) as img:
+            if img.format == "JPEG" and max(img.size) <= MAX_IMAGE_DIMENSION:
+                return bytes(image_data)
+            img.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION), Image.Resampling.LANCZOS)
+            buf = io.BytesIO()
+            img.convert("RGB").save(buf, format="JPEG", quality=PAYLOAD_JPEG_QUALITY)
+            return buf.getvalue()
+    except OSError as e:
+        print(f"[WARN] Could not downscale image, sending original: {e}")
+        return bytes(image_data)
+
+
+def _encode_image_base64(image_bytes) -> str:
+    """Return the base64 encoding of an image payload."""
+    return base64.b64encode(image_bytes).decode("ascii")
+
+
+def _read_json_object(stream) -> str:
+    """Accumulate streamed completion chunks until one top-level JSON object closes.
+
+    Braces are counted outside of string literals, so the text is returned as
+    soon as the object is complete and any surrounding prose or markdown
+    fences are dropped. If the stream ends first, everything received is
+    returned and the caller's JSON parse reports the problem.
+    """
+    parts = []
+    depth = 0
+    in_string = escaped = False
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        for i, ch in enumerate(delta):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == "{":
+                depth += 1
+            elif depth:
+                if ch == '"':
+                    in_string = True
+                elif ch == "}":
+                    depth -= 1
+                    if depth == 0:
+                        parts.append(delta[:i + 1])
+                        text = "".join(parts)
+                        return text[text.index("{"):]
+        parts.append(delta)
+    return "".join(parts).strip()
+
+
+def _error_analysis(description: str, surface: str, integrity: str) -> dict:
+    """Placeholder analysis reported when Groq could not analyze an image."""
+    return {
+        "image_description": description,
+        "defects_found": [],
+        "surface_condition": {"overall": surface},
+        "risk_assessment": {
+            "overall_risk": "Unknown",
+            "structural_integrity": integrity,
+            "immediate_concerns": [],
+            "recommended_actions": ["Re-inspect this area"],
+        },
+        "confidence_score": 0.0,
+    }
+
+
+def _parse_analyses(text: str, count: int) -> list:
+    """Parse a (batch) response into one analysis dict per image.
+
+    Raises ValueError unless every analysis is a JSON object, so a malformed
+    answer is never cached or sent to the dashboard.
+    """
+    result = _json_loads(text)
+    if count == 1:
+        analyses = [result]
+    else:
+        analyses = result.get("analyses") if isinstance(result, dict) else None
+        if not isinstance(analyses, list) or len(analyses) != count:
+            raise ValueError(f"expected {count} analyses in the batch response")
+    if not all(isinstance(analysis, dict) for analysis in analyses):
+        raise ValueError("expected each analysis to be a JSON object")
+    return analyses
+
+
+def analyze_images(images_b64: list, cache_keys: list = None, phashes: list = None) -> list:
+    """Send one or more images to Groq (Llama 4 Scout) in a single request.
+
+    ``images_b64`` are already-encoded JPEG payloads. Returns one structural
+    analysis per image, in order. Successful results are written to the
+    analysis cache under ``cache_keys`` and to ``phash_cache`` under ``phashes``.
+    Includes automatic retry with backoff for rate-limit (429), connection,
+    timeout and 5xx errors.
+    """
+    count = len(images_b64)
+    prompt = ANALYSIS_PROMPT if count == 1 else BATCH_PROMPT_HEADER.format(count=count) + ANALYSIS_PROMPT
+    content = [{"type": "text", "text": prompt}]
+    content.extend(
+        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}}
+        for b64 in images_b64
+    )
 
     for attempt in range(1, MAX_RETRIES + 1):
+        rate_limiter.acquire()
+        text = ""
         try:
-            response = client.chat.completions.create(
+            stream = client.chat.completions.create(
                 model=MODEL_NAME,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": ANALYSIS_PROMPT},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime};base64,{image_b64}",
-                                },
-                            },
-                        ],
-                    }
-                ],
+                messages=[{"role": "user", "content": content}],
                 temperature=0.2,
-                max_completion_tokens=2048,
-                response_format={"type": "json_object"},
+                max_completion_tokens=MAX_TOKENS_PER_IMAGE * count,
+                stream=True,
             )
 
-            text = response.choices[0].message.content.strip()
-
-            # Strip markdown code fences if present (safety net)
-            if text.startswith("```"):
-                text = text.split("\n", 1)[1]
-                if text.endswith("```"):
-                    text = text[:-3]
-                text = text.strip()
-
-            analysis = json.loads(text)
-            return analysis
-
-        except json.JSONDecodeError as e:
+            # Stop reading as soon as the JSON object is complete
+            try:
+                text = _read_json_object(stream)
+            finally:
+                stream.close()
+
+            analyses = _parse_analyses(text, count)
+            for key, phash, analysis in zip(cache_keys or [None] * count,
+                                            phashes or [None] * count, analyses):
+                if key:
+                    _store_cached_analysis(key, analysis)
+                    phash_cache.add(phash, key)
+            return analyses
+
+        except ValueError as e:   # includes json.JSONDecodeError
             raw = text[:500] if text else "None"
             print(f"[WARN] Failed to parse Groq response as JSON: {e}")
             print(f"[WARN] Raw response: {raw}")
-            return {
-                "image_description": "Analysis parsing failed",
-                "defects_found": [],
-                "surface_condition": {"overall": "Unknown"},
-                "risk_assessment": {
-                    "overall_risk": "Unknown",
-                    "structural_integrity": "Unable to parse response",
-                    "immediate_concerns": [],
-                    "recommended_actions": ["Re-inspect this area"],
-                },
-                "confidence_score": 0.0,
-            }
+            if count > 1:
+                # A malformed batch says nothing about the individual images
+                print(f"[WARN] Retrying the {count} images of this batch one at a time")
+                return [analyze_images([b64], [key], [phash])[0]
+                        for b64, key, phash in zip(images_b64, cache_keys or [None] * count,
+                                                   phashes or [None] * count)]
+            return [_error_analysis("Analysis parsing failed", "Unknown",
+                                    "Unable to parse response")] * count
+
+        except RateLimitError as e:
+            if attempt == MAX_RETRIES:
+                print(f"[ERROR] Groq analysis failed: {e}")
+                break
+            delay = _retry_delay(e) + 2
+            print(f"[RATE LIMIT] Hit limit (attempt {attempt}/{MAX_RETRIES}). "
+                  f"Waiting {delay:.0f}s before retry...")
+            time.sleep(delay)
+
+        # APITimeoutError is a subclass of APIConnectionError
+        except (APIConnectionError, InternalServerError) as e:
+            if attempt == MAX_RETRIES:
+                print(f"[ERROR] Groq analysis failed: {e}")
+                break
+            delay = TRANSIENT_RETRY_DELAY * 2 ** (attempt - 1)
+            print(f"[RETRY] Transient Groq error (attempt {attempt}/{MAX_RETRIES}): {e} "
+                  f"– retrying in {delay:.0f}s...")
+            time.sleep(delay)
 
         except Exception as e:
-            err_str = str(e)
-            is_rate_limit = "429" in err_str or "rate" in err_str.lower() or "quota" in err_str.lower()
-
-            if is_rate_limit and attempt < MAX_RETRIES:
-                delay = _parse_retry_delay(err_str) + 2
-                print(f"[RATE LIMIT] Hit limit (attempt {attempt}/{MAX_RETRIES}). "
-                      f"Waiting {delay:.0f}s before retry...")
-                time.sleep(delay)
-                continue
-            else:
-                print(f"[ERROR] Groq analysis failed: {e}")
-                return {
-                    "image_description": f"Analysis error: {str(e)[:200]}",
-                    "defects_found": [],
-                    "surface_condition": {"overall": "Error"},
-                    "risk_assessment": {
-                        "overall_risk": "Unknown",
-                        "structural_integrity": "Analysis failed",
-                        "immediate_concerns": [],
-                        "recommended_actions": ["Re-inspect this area"],
-                    },
-                    "confidence_score": 0.0,
-                }
-
-    return {"image_description": "Max retries exceeded", "defects_found": [],
-            "surface_condition": {"overall": "Error"},
-            "risk_assessment": {"overall_risk": "Unknown", "structural_integrity": "Retries exhausted",
-                                "immediate_concerns": [], "recommended_actions": ["Re-inspect"]},
-            "confidence_score": 0.0}
+            print(f"[ERROR] Groq analysis failed: {e}")
+            return [_error_analysis(f"Analysis error: {str(e)[:200]}", "Error",
+                                    "Analysis failed")] * count
+
+    return [_error_analysis("Max retries exceeded", "Error", "Retries exhausted")] * count
 
 # ---------------------------------------------------------------------------
 # Send results to dashboard
 # ---------------------------------------------------------------------------
 
-def send_to_dashboard(image_name: str, image_path: str, analysis: dict):
-    """POST analysis result to the Flask dashboard."""
-    try:
-        with open(image_path, "rb") as f:
-            image_b64 = base64.b64encode(f.read()).decode("utf-8")
-    except Exception:
-        image_b64 = ""
+def send_to_dashboard(image_name: str, image_bytes: bytes, analysis: dict):
+    """POST analysis result to the Flask dashboard.
 
-    payload = {
+    The JPEG is sent as a raw multipart file part rather than base64 inside
+    JSON, avoiding the encode step and the 33% size overhead.
+    """
+    form = {
         "image_name": image_name,
-        "image_base64": image_b64,
         "timestamp": datetime.now().isoformat(),
-        "analysis": analysis,
+        "analysis": _json_dumps(analysis),
     }
+    files = {"image": (image_name, image_bytes, "image/jpeg")}
 
     try:
-        resp = requests.post(DASHBOARD_URL, json=payload, timeout=5)
+        resp = _session.post(DASHBOARD_URL, data=form, files=files, timeout=5)
         if resp.status_code == 200:
             risk = analysis.get("risk_assessment", {}).get("overall_risk", "Unknown")
             print(f"[DASHBOARD] Sent analysis for {image_name} (risk: {risk})")
@@ -248,13 +573,56 @@ def send_to_dashboard(image_name: str, image_path: str, analysis: dict):
 # File Watcher
 # ---------------------------------------------------------------------------
 
+def _wait_stable(path, interval=SETTLE_INTERVAL, stable_rounds=SETTLE_ROUNDS,
+                 timeout=SETTLE_TIMEOUT):
+    """Block until the file's size is unchanged for ``stable_rounds`` polls.
+
+    Returns as soon as the writer is done instead of always sleeping a fixed
+    amount; gives up after ``timeout`` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    last_size, stable = -1, 0
+    while time.monotonic() < deadline:
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            size = -1
+        if size == last_size and size > 0:
+            stable += 1
+            if stable >= stable_rounds:
+                return
+        else:
+            stable = 0
+        last_size = size
+        time.sleep(interval)
+
+
+def _report_failure(label: str, future):
+    """Done-callback for pool tasks: print an unexpected exception instead of dropping it."""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        print(f"[ERROR] Processing {label} failed: {error!r}")
+
+
 class ImageHandler(FileSystemEventHandler):
     """Watch for new .jpg files in the inspection_images directory."""
 
     def __init__(self):
         super().__init__()
-        self.processed = set()
-        self.last_api_call = 0.0
+        self.processed = OrderedDict()   # LRU of seen paths, capped at MAX_TRACKED_PATHS
+        self.processed_lock = threading.Lock()
+        # Per-image preparation (settle, hash, cache lookup) and batched
+        # Groq requests run on separate pools so shutdown can drain them in order
+        self.preparer = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        self.pending = []        # images waiting to be batched into one request
+        self.pending_lock = threading.Lock()
+        self.flush_timer = None
+        # Dashboard POSTs run on their own thread so a worker can start its
+        # next Groq call immediately; one thread keeps results in order.
+        self.uploader = ThreadPoolExecutor(max_workers=1)
 
     def on_created(self, event):
         if event.is_directory:
@@ -267,32 +635,134 @@ class ImageHandler(FileSystemEventHandler):
         self._handle(event.src_path)
 
     def _handle(self, filepath):
-        if not filepath.lower().endswith((".jpg", ".jpeg", ".png")):
+        if not filepath.lower().endswith(IMAGE_EXTENSIONS):
             return
-        if filepath in self.processed:
-            return
-
-        # Small delay to ensure the file is fully written
-        time.sleep(0.5)
+        # on_created and on_modified both fire for a new file; dispatch it once
+        with self.processed_lock:
+            if filepath in self.processed:
+                self.processed.move_to_end(filepath)
+                return
+            self.processed[filepath] = None
+            if len(self.processed) > MAX_TRACKED_PATHS:
+                self.processed.popitem(last=False)
+
+        future = self.preparer.submit(self._process, filepath)
+        future.add_done_callback(partial(_report_failure, os.path.basename(filepath)))
+
+    def _process(self, filepath):
+        """Prepare one image on a worker thread; reuse a cached result or queue it for Groq."""
+        # Ensure the file is fully written
+        _wait_stable(filepath)
 
         filename = os.path.basename(filepath)
         print(f"\n[WATCHER] New image detected: {filename}")
-        self.processed.add(filepath)
 
-        # Throttle: wait between API calls to stay within rate limits
-        elapsed = time.time() - self.last_api_call
-        if elapsed < THROTTLE_BETWEEN_IMAGES:
-            wait = THROTTLE_BETWEEN_IMAGES - elapsed
-            print(f"[THROTTLE] Waiting {wait:.1f}s before next API call...")
-            time.sleep(wait)
+        # Map only while hashing and decoding; everything queued from here on
+        # (payload, cache key, phash) is independent of the file
+        try:
+            image_data = _map_image(filepath)
+        except (OSError, ValueError) as e:   # ValueError: empty file
+            print(f"[ERROR] Could not read {filename}: {e}")
+            return
+        try:
+            cache_key = _cache_key(image_data)
+            cached = _load_cached_analysis(cache_key)
+            phash = None if cached is not None else phash_cache.compute(image_data)
+            # The (downscaled) JPEG payload is shared by Groq and the dashboard
+            payload = _shrink_image(image_data)
+        finally:
+            image_data.close()
+
+        # Identical image already analyzed: skip Groq and the rate limiter entirely
+        if cached is not None:
+            print(f"[CACHE] Reusing cached analysis for {filename}")
+            self._publish(filename, payload, cached)
+            return
+
+        # Near-duplicate of an analyzed frame: reuse its analysis as well
+        similar = phash_cache.lookup(phash)
+        if similar is not None:
+            print(f"[CACHE] {filename} is a near-duplicate of an analyzed frame – reusing analysis")
+            self._publish(filename, payload, similar)
+            return
 
-        # Analyze with Groq
-        print(f"[GROQ] Analyzing {filename}...")
-        self.last_api_call = time.time()
-        analysis = analyze_image(filepath)
+        # Queue for a batched Groq request
+        self._enqueue((filename, payload, cache_key, phash))
+
+    def _enqueue(self, item):
+        """Add an image to the pending batch; send it once full, or after an idle period."""
+        with self.pending_lock:
+            self.pending.append(item)
+            if len(self.pending) >= BATCH_SIZE:
+                batch = self._take_pending()
+            else:
+                batch = None
+                if self.flush_timer is not None:
+                    self.flush_timer.cancel()
+                self.flush_timer = threading.Timer(BATCH_IDLE_FLUSH, self._flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+        if batch:
+            self._submit_batch(batch)
+
+    def _submit_batch(self, batch):
+        future = self.executor.submit(self._analyze_batch, batch)
+        future.add_done_callback(partial(_report_failure, ", ".join(item[0] for item in batch)))
+
+    def _take_pending(self):
+        """Detach the pending batch. Caller must hold ``pending_lock``."""
+        batch, self.pending = self.pending, []
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        return batch
+
+    def _flush(self):
+        """Send whatever is pending, even if the batch is not full."""
+        with self.pending_lock:
+            batch = self._take_pending()
+        if batch:
+            self._submit_batch(batch)
+
+    def _analyze_batch(self, batch):
+        """Analyze a batch with one Groq request and fan the results out to the dashboard."""
+        filenames, payloads, cache_keys, phashes = zip(*batch)
+        print(f"[GROQ] Analyzing {', '.join(filenames)}...")
+        analyses = analyze_images([_encode_image_base64(p) for p in payloads],
+                                  cache_keys, phashes)
 
         # Send to dashboard
-        send_to_dashboard(filename, filepath, analysis)
+        for filename, payload, analysis in zip(filenames, payloads, analyses):
+            self._publish(filename, payload, analysis)
+
+    def _publish(self, filename, image_bytes, analysis):
+        """Queue a dashboard POST without blocking the calling worker."""
+        self.uploader.submit(send_to_dashboard, filename, image_bytes, analysis)
+
+    def shutdown(self):
+        """Wait for in-flight analyses and dashboard uploads to finish."""
+        self.preparer.shutdown(wait=True)
+        self._flush()
+        self.executor.shutdown(wait=True)
+        self.uploader.shutdown(wait=True)
+
+
+def _create_observer():
+    """Return the kernel-notified observer for this platform.
+
+    watchdog's default ``Observer`` silently degrades to directory polling
+    when the native backend is unavailable; request it explicitly instead.
+    """
+    try:
+        if sys.platform.startswith("linux"):
+            from watchdog.observers.inotify import InotifyObserver
+            return InotifyObserver()
+        if sys.platform == "darwin":
+            from watchdog.observers.fsevents import FSEventsObserver
+            return FSEventsObserver()
+    except ImportError as e:
+        print(f"[WARN] Native file watcher unavailable ({e}) – using default observer")
+    return Observer()
 
 # ---------------------------------------------------------------------------
 # Main
@@ -300,15 +770,19 @@ class ImageHandler(FileSystemEventHandler):
 
 def process_existing_images(handler):
     """Process any images already in the directory (from a previous or ongoing run)."""
-    image_dir = Path(IMAGE_DIR)
-    if not image_dir.exists():
+    if not os.path.isdir(IMAGE_DIR):
         return
 
-    existing = sorted(image_dir.glob("*.jpg"))
+    # scandir yields cheap DirEntry objects; capture_NNNN names sort in capture order
+    with os.scandir(IMAGE_DIR) as it:
+        existing = sorted(
+            (e for e in it if e.name.lower().endswith(IMAGE_EXTENSIONS) and e.is_file()),
+            key=lambda e: e.name,
+        )
     if existing:
         print(f"[STARTUP] Found {len(existing)} existing images – processing...")
-        for img_path in existing:
-            handler._handle(str(img_path))
+        for entry in existing:
+            handler._handle(entry.path)
 
 
 def main():
@@ -318,8 +792,8 @@ def main():
     print(f"  AI Model: Groq Llama 4 Scout")
     print(f"  Model ID: {MODEL_NAME}")
     print(f"  Dashboard: {DASHBOARD_URL}")
-    print(f"  Throttle: {THROTTLE_BETWEEN_IMAGES}s between API calls")
-    print(f"  Retry: up to {MAX_RETRIES}x on rate-limit errors")
+    print(f"  Rate limit: {RATE_LIMIT_CALLS} calls / {RATE_LIMIT_PERIOD:.0f}s, {MAX_WORKERS} workers")
+    print(f"  Retry: up to {MAX_RETRIES}x on rate-limit and transient errors")
     print("=" * 60)
 
     # Ensure image directory exists
@@ -331,7 +805,7 @@ def main():
     process_existing_images(handler)
 
     # Start file watcher
-    observer = Observer()
+    observer = _create_observer()
     observer.schedule(handler, IMAGE_DIR, recursive=False)
     observer.start()
 
@@ -346,6 +820,7 @@ def main():
         observer.stop()
 
     observer.join()
+    handler.shutdown()
     print("[WATCHER] Pipeline stopped.")
 
 
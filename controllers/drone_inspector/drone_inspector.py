@@ -14,10 +14,19 @@ The drone:
 import json
 import math
 import os
+import queue
 import sys
+import threading
 
 from controller import Robot
 
+# Pillow lets captures be JPEG-encoded off the control loop; without it the
+# controller falls back to Webots' synchronous camera.saveImage().
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
@@ -26,34 +35,42 @@ def clamp(value, low, high):
     return max(low, min(value, high))
 
 def normalize_angle(angle):
-    """Normalize angle to [-pi, pi]."""
-    while angle > math.pi:
-        angle -= 2 * math.pi
-    while angle < -math.pi:
-        angle += 2 * math.pi
-    return angle
-
-def get_yaw(imu):
-    """Return the yaw angle from the IMU (rotation around vertical axis)."""
-    return imu.getRollPitchYaw()[2]
-
-def decompose_displacement(dx, dy, heading):
+    """Normalize angle to [-pi, pi] in constant time (IEEE remainder)."""
+    return math.remainder(angle, 2 * math.pi)
+
+def decompose_displacement(dx, dy, cos_h, sin_h):
     """Decompose a 2D displacement (dx, dy) into forward and lateral (right)
     components relative to the drone's heading.
 
-    heading: yaw angle in radians (0 = +X, CCW positive).
+    cos_h, sin_h: cosine and sine of the heading yaw (0 = +X, CCW positive),
+    precomputed once per side since the heading is fixed while strafing.
     Returns (forward_component, right_component).
       - forward_component > 0 means drifted in the camera/facing direction
       - right_component  > 0 means moved to the drone's right (strafe direction)
     """
-    cos_h = math.cos(heading)
-    sin_h = math.sin(heading)
     # Forward direction unit vector: (cos_h, sin_h)
     # Right direction unit vector:   (sin_h, -cos_h)
     forward = dx * cos_h + dy * sin_h
     right   = dx * sin_h - dy * cos_h
     return forward, right
 
+def image_writer(jobs):
+    """Worker thread: JPEG-encode raw camera frames and write them to disk.
+
+    Each job is (bgra_bytes, width, height, filename); None stops the worker.
+    """
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        buf, width, height, filename = job
+        try:
+            # Webots camera images are BGRA, 8 bits per channel
+            img = Image.frombuffer("RGBA", (width, height), buf, "raw", "BGRA", 0, 1)
+            img.convert("RGB").save(filename, quality=80)
+        except Exception as e:
+            print(f"[CAMERA] Failed to save {filename}: {e}")
+
 # ---------------------------------------------------------------------------
 # Flight states
 # ---------------------------------------------------------------------------
@@ -164,6 +181,13 @@ def main():
     image_dir = os.path.join(os.path.dirname(__file__), "..", "..", "inspection_images")
     os.makedirs(image_dir, exist_ok=True)
     image_counter = 0
+    # Encoding + writing a JPEG can take tens of ms, so it runs on a worker
+    # thread to keep the per-step control loop timing steady.
+    write_jobs = queue.Queue()
+    writer = None
+    if Image is not None:
+        writer = threading.Thread(target=image_writer, args=(write_jobs,), daemon=True)
+        writer.start()
     # capture_distances holds the distances at which to take each photo on the
     # current side.  images_taken_this_side counts how many have been taken.
     capture_distances = []
@@ -181,14 +205,19 @@ def main():
 
     # Yaw tracking: initialized after sensors warm up.
     accumulated_yaw = 0.0
+    heading_cos, heading_sin = 1.0, 0.0   # cos/sin of accumulated_yaw for the current side
     stabilize_start_time = None
 
     def begin_side(side_dist, gps_position):
         """Prepare capture distances and state for a new side."""
         nonlocal capture_distances, images_taken_this_side
         nonlocal state_start_pos, current_side_distance
+        nonlocal heading_cos, heading_sin
         state_start_pos = list(gps_position)
         current_side_distance = side_dist
+        # Heading is constant along a side; compute its trig once
+        heading_cos = math.cos(accumulated_yaw)
+        heading_sin = math.sin(accumulated_yaw)
         images_taken_this_side = 0
         # Evenly spaced capture points: at 25%, 50%, 75%, 100% of side length
         capture_distances = [
@@ -209,7 +238,7 @@ def main():
             break
 
     # ---- Read initial yaw from IMU to calibrate heading ----
-    initial_yaw = get_yaw(imu)
+    initial_yaw = imu.getRollPitchYaw()[2]
     accumulated_yaw = initial_yaw
     print(f"[DRONE] Initial yaw: {math.degrees(initial_yaw):.1f} deg")
 
@@ -217,14 +246,11 @@ def main():
     while robot.step(timestep) != -1:
         time = robot.getTime()
 
-        # -- Read sensors --
-        roll  = imu.getRollPitchYaw()[0]
-        pitch = imu.getRollPitchYaw()[1]
-        altitude = gps.getValues()[2]
-        roll_velocity  = gyro.getValues()[0]
-        pitch_velocity = gyro.getValues()[1]
+        # -- Read sensors (one device call each per step) --
+        roll, pitch, yaw = imu.getRollPitchYaw()
+        roll_velocity, pitch_velocity, _ = gyro.getValues()
         gps_pos = gps.getValues()  # [x, y, z]
-        yaw = get_yaw(imu)
+        altitude = gps_pos[2]
 
         # -- Blink LEDs --
         led_state = int(time) % 2
@@ -268,7 +294,7 @@ def main():
             dx = gps_pos[0] - state_start_pos[0]
             dy = gps_pos[1] - state_start_pos[1]
             forward_drift, lateral_distance = decompose_displacement(
-                dx, dy, accumulated_yaw
+                dx, dy, heading_cos, heading_sin
             )
 
             # -- Forward-drift correction --
@@ -288,7 +314,11 @@ def main():
                 image_counter += 1
                 images_taken_this_side += 1
                 filename = os.path.join(image_dir, f"capture_{image_counter:04d}.jpg")
-                camera.saveImage(filename, 80)  # quality = 80
+                if writer is not None:
+                    write_jobs.put((camera.getImage(), camera.getWidth(),
+                                    camera.getHeight(), filename))
+                else:
+                    camera.saveImage(filename, 80)  # quality = 80
                 side_name = state
                 print(f"[CAMERA] {side_name} – photo {images_taken_this_side}/{IMAGES_PER_SIDE} "
                       f"at {distance_traveled:.1f}m  ->  {filename}")
@@ -367,6 +397,11 @@ def main():
         motors[2].setVelocity(-rl)
         motors[3].setVelocity(rr)
 
+    # Flush any captures still being written
+    if writer is not None:
+        write_jobs.put(None)
+        writer.join()
+
     print("[DRONE] Controller finished.")
 
 # ---------------------------------------------------------------------------
@@ -6,55 +6,352 @@ Flask server with Server-Sent Events (SSE) for real-time updates.
 Endpoints:
   GET  /            - Main dashboard page
   POST /api/analysis - Receive analysis results from the analyzer pipeline
+                       (multipart: "image" file + "analysis" JSON field, or a JSON body)
   GET  /stream      - SSE stream of new analysis results
-  GET  /api/history - Return all past analysis results as JSON
+  GET  /api/history - Return recent analysis results as JSON
+                       (?fields=summary for id, name, timestamp and risk only)
+  GET  /api/image/<id> - Return the image for a history entry
 """
 
-import sys
 import os
+import atexit
+import base64
+import io
+import itertools
 import json
+import logging
+import logging.handlers
 import queue
+import secrets
+import struct
 import threading
+import time
+import zlib
+from collections import deque
 from datetime import datetime
 
-# Bootstrap to use venv if not already active
-if sys.base_prefix == sys.prefix:
-    if os.name == 'nt':
-        venv_python = os.path.join(os.path.dirname(__file__), "..", "venv", "Scripts", "python.exe")
-    else:
-        venv_python = os.path.join(os.path.dirname(__file__), "..", "venv", "bin", "python")
-    
-    if os.path.exists(venv_python):
-        os.execv(venv_python, [venv_python] + sys.argv)
+from flask import Flask, Response, render_template, request, send_file, stream_with_context
+from flask_compress import Compress
+
+# orjson parses/serializes in C and emits bytes directly; fall back to the stdlib
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
 
-from flask import Flask, Response, jsonify, render_template, request
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+# redis is only needed when REDIS_URL is set (multi-process deployments)
+try:
+    import redis
+except ImportError:
+    redis = None
 
 app = Flask(__name__)
+# Larger uploads are rejected with 413 before the body is read
+app.config["MAX_CONTENT_LENGTH"] = 20 * 1024 * 1024
+# gzip JSON/HTML/CSS responses for clients that accept it (SSE is handled in /stream).
+# flask-compress >= 1.22 compresses streamed responses such as /api/history
+# chunk by chunk; older releases buffer the whole body first.
+Compress(app)
+
+# Request handlers only enqueue log records; a listener thread formats them
+# and writes to stderr, so logging never blocks a request on console I/O.
+logger = logging.getLogger("dashboard")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(logging.Formatter("[DASHBOARD] %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_output)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
 # ---------------------------------------------------------------------------
 # In-memory storage and SSE infrastructure
 # ---------------------------------------------------------------------------
 
-analysis_history = []   # List of all analysis results
+# History is bounded by entry count and by the total size of the images it
+# holds; the oldest entries are evicted first.
+MAX_HISTORY = 1000
+MAX_HISTORY_BYTES = 256 * 1024 * 1024
+
+# Entries only carry metadata; the JPEG bytes live in `images` and are
+# fetched lazily via /api/image/<id>.
+analysis_history = deque()   # Recent analysis results, oldest first
+images = {}                  # entry ID -> raw image bytes
+history_bytes = 0            # Total size of the bytes in `images`
 history_lock = threading.Lock()
+# IDs stay unique after eviction; count.__next__ is atomic under the GIL,
+# so no lock is needed to allocate one.
+next_entry_id = itertools.count(1).__next__
+# Local IDs restart at 1 with the process, so image URLs carry a per-boot
+# token; a browser can then cache /api/image responses without ever showing
+# a picture from a previous run under a reused ID.
+BOOT_ID = secrets.token_hex(4)
+
+
+def _append_history(entry: dict, image: bytes):
+    """Store an entry and its image, evicting the oldest over budget. Caller holds ``history_lock``."""
+    global history_bytes
+    analysis_history.append(entry)
+    if image:
+        images[entry["id"]] = image
+        history_bytes += len(image)
+    while len(analysis_history) > 1 and (
+            len(analysis_history) > MAX_HISTORY or history_bytes > MAX_HISTORY_BYTES):
+        evicted = analysis_history.popleft()
+        history_bytes -= len(images.pop(evicted["id"], b""))
+
+class SPSCRing:
+    """Bounded single-producer / single-consumer queue for one SSE client.
+
+    ``tail`` and ``floor`` are only written by the producer and ``head`` only
+    by the consumer, so ``put_nowait``/``get`` need no lock; an Event is used
+    just to wake a waiting consumer. The coalescer thread is the only
+    producer.
+
+    ``floor`` lets the producer discard unread items (``drop_oldest``)
+    without touching ``head``: the consumer skips everything below it.
+    """
+
+    def __init__(self, capacity: int = 128):
+        if capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.buf = [None] * capacity
+        self.head = 0    # next slot to read (consumer)
+        self.tail = 0    # next slot to write (producer)
+        self.floor = 0   # slots below this were dropped (producer)
+        self.closed = False
+        self.ready = threading.Event()
+        # Overflow tracking for the slow-client policy (producer only)
+        self.full_count = 0
+        self.last_full = 0.0
+
+    def put_nowait(self, item):
+        tail = self.tail
+        if tail - max(self.head, self.floor) >= self.capacity:
+            raise queue.Full
+        self.buf[tail & self.mask] = item
+        self.tail = tail + 1
+        self.ready.set()
+
+    def drop_oldest(self):
+        """Discard the oldest unread item to make room (producer side)."""
+        self.floor = max(self.head, self.floor) + 1
+
+    def close(self):
+        """Disconnect the consumer: its pending and future ``get`` calls return None."""
+        self.closed = True
+        self.ready.set()
+
+    def get(self, timeout=None):
+        while True:
+            if self.closed:
+                return None
+            head = max(self.head, self.floor)
+            if head == self.tail:
+                self.ready.clear()
+                # Re-check after clearing so a put in between is not missed
+                if head == self.tail and not self.ready.wait(timeout):
+                    raise queue.Empty
+                continue
+            # Slots are not cleared on read: the producer may reuse this one
+            # at any moment once it is dropped, and clearing could erase that
+            item = self.buf[head & self.mask]
+            if self.floor > head:
+                continue   # dropped (and possibly overwritten) while reading
+            self.head = head + 1
+            return item
+
+
+# SSE: each connected client gets its own queue. Clients are spread over
+# shards, each with its own lock, so subscribing, unsubscribing and
+# broadcasting only contend within a shard. Each shard is a set so a
+# disconnect is an O(1) discard rather than a list scan.
+SSE_SHARD_COUNT = 16   # power of two (shard index is a bit mask)
+sse_shards = [(set(), threading.Lock()) for _ in range(SSE_SHARD_COUNT)]
+
+
+# Shards are handed out round-robin: object ids/hashes are allocation
+# aligned, so their low bits would put most clients in the same few shards
+_next_shard = itertools.count().__next__
+
+
+def _assign_shard():
+    return sse_shards[_next_shard() & (SSE_SHARD_COUNT - 1)]
 
-# SSE: each connected client gets its own queue
-sse_clients = []
-sse_clients_lock = threading.Lock()
+
+# Fixed SSE frames, encoded once. A new client gets the connected event and
+# an immediate keep-alive in a single write.
+CONNECTED_MSG = b'data: {"type":"connected"}\n\n'
+KEEPALIVE_MSG = b": keepalive\n\n"
+SUBSCRIBED_MSG = CONNECTED_MSG + KEEPALIVE_MSG
+# Seconds of silence before a keep-alive is sent; short enough that idle
+# connections are written to (and dead ones noticed) regularly
+SSE_KEEPALIVE_INTERVAL = 15
+
+
+# Entries arriving within COALESCE_MS of each other are sent to clients as
+# one SSE event holding a JSON array, so a burst costs one queue put and one
+# socket write per client instead of one per entry.
+COALESCE_MS = 10
+MAX_BATCH = 32
+pending_events = queue.Queue()
 
 
 def broadcast_event(data: dict):
-    """Push an event to all connected SSE clients."""
-    message = f"data: {json.dumps(data)}\n\n"
-    with sse_clients_lock:
+    """Queue an event for the next SSE batch."""
+    pending_events.put(data)
+
+
+def _coalesce_loop():
+    """Collect queued events into batches and push each batch to all clients.
+
+    The batch is serialized and encoded once; every client queue receives
+    the same immutable bytes object.
+    """
+    while True:
+        batch = [pending_events.get()]
+        deadline = time.monotonic() + COALESCE_MS / 1000
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(pending_events.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _fan_out(b"".join((b"data: ", _json_dumps(batch), b"\n\n")))
+
+
+# A client whose queue overflows SLOW_CLIENT_MAX_OVERFLOWS times within
+# SLOW_CLIENT_WINDOW seconds is disconnected; rarer overflows only drop
+# the oldest queued event.
+SLOW_CLIENT_WINDOW = 5.0
+SLOW_CLIENT_MAX_OVERFLOWS = 3
+
+
+def _should_evict(q: SPSCRing) -> bool:
+    """Record an overflow for ``q`` and decide whether it is chronically slow."""
+    now = time.monotonic()
+    if now - q.last_full > SLOW_CLIENT_WINDOW:
+        q.full_count = 0
+    q.full_count += 1
+    q.last_full = now
+    return q.full_count >= SLOW_CLIENT_MAX_OVERFLOWS
+
+
+def _fan_out(message: bytes):
+    """Push one encoded frame to every client. Only called from the coalescer thread."""
+    for clients, lock in sse_shards:
+        # Copy under the lock, push outside it so a slow client can't stall others
+        with lock:
+            targets = list(clients)
         dead = []
-        for q in sse_clients:
+        for q in targets:
             try:
                 q.put_nowait(message)
             except queue.Full:
-                dead.append(q)
-        for q in dead:
-            sse_clients.remove(q)
+                if _should_evict(q):
+                    dead.append(q)
+                else:
+                    # Briefly slow: lose its oldest event rather than the connection
+                    q.drop_oldest()
+                    q.put_nowait(message)
+        if dead:
+            with lock:
+                clients.difference_update(dead)
+            for q in dead:
+                q.close()
+
+
+threading.Thread(target=_coalesce_loop, name="sse-coalescer", daemon=True).start()
+
+
+# ---------------------------------------------------------------------------
+# Multi-process fan-out (optional)
+# ---------------------------------------------------------------------------
+
+# With REDIS_URL set, each result is published to a Redis channel instead of
+# being stored directly. Every dashboard process (gunicorn worker or host)
+# runs one subscriber that ingests results into its own history and SSE
+# clients, so all browsers see all results whichever process received them.
+# History itself stays per process: a process that (re)starts only has the
+# results published since, and 404s images from before.
+REDIS_URL = os.environ.get("REDIS_URL")
+REDIS_CHANNEL = "drone-inspection:analysis"
+REDIS_ID_KEY = "drone-inspection:next-id"
+
+redis_client = None
+if REDIS_URL:
+    if redis is None:
+        logger.warning("REDIS_URL is set but redis is not installed; running single-process")
+    else:
+        redis_client = redis.Redis.from_url(REDIS_URL)
+
+
+def _ingest(entry: dict, image: bytes):
+    """Store an entry locally and queue it for this process's SSE clients."""
+    with history_lock:
+        _append_history(entry, image)
+    broadcast_event(entry)
+
+
+def _pack_event(entry: dict, image: bytes) -> bytes:
+    """Frame an entry and its image as one binary message: length, JSON, image."""
+    header = _json_dumps(entry)
+    return struct.pack("!I", len(header)) + header + image
+
+
+def _unpack_event(message: bytes):
+    (size,) = struct.unpack_from("!I", message)
+    return _json_loads(message[4:4 + size]), message[4 + size:]
+
+
+def _redis_subscriber():
+    """Ingest results published by any dashboard process (one connection per process)."""
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(REDIS_CHANNEL)
+            for message in pubsub.listen():
+                # A bad frame must not take down the only subscriber
+                try:
+                    _ingest(*_unpack_event(message["data"]))
+                except Exception:
+                    logger.exception("Dropping unreadable Redis message")
+        except redis.RedisError as e:
+            logger.warning("Redis subscriber error: %s; reconnecting", e)
+            time.sleep(1)
+        finally:
+            pubsub.close()
+
+
+if redis_client is not None:
+    threading.Thread(target=_redis_subscriber, name="redis-subscriber", daemon=True).start()
+
+
+def gzip_stream(chunks):
+    """Gzip a stream of byte chunks, flushing after each so every event is delivered immediately."""
+    compressor = zlib.compressobj(wbits=31)   # 31 = gzip container
+    try:
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    finally:
+        chunks.close()
+
+
+def json_response(obj, status: int = 200) -> Response:
+    """Serialize ``obj`` with orjson into an application/json response."""
+    return Response(_json_dumps(obj), status=status, mimetype="application/json")
 
 
 # ---------------------------------------------------------------------------
@@ -70,81 +367,143 @@ def index():
 @app.route("/api/analysis", methods=["POST"])
 def receive_analysis():
     """Receive an analysis result from the analyzer pipeline."""
-    data = request.get_json(force=True)
-    if not data:
-        return jsonify({"error": "No JSON body"}), 400
+    if "image" in request.files:
+        # Multipart upload: raw JPEG bytes plus JSON-encoded analysis field
+        try:
+            analysis = _json_loads(request.form.get("analysis") or "{}")
+        except json.JSONDecodeError:
+            return json_response({"error": "Invalid analysis JSON"}, 400)
+        data = {
+            "image_name": request.form.get("image_name", "unknown"),
+            "timestamp": request.form.get("timestamp") or datetime.now().isoformat(),
+            "analysis": analysis,
+        }
+        image = request.files["image"].read()
+    else:
+        # Parse the raw body directly; skips Flask's text decoding and caching
+        try:
+            data = _json_loads(request.get_data(cache=False))
+        except json.JSONDecodeError:
+            return json_response({"error": "Invalid JSON body"}, 400)
+        if not data or not isinstance(data, dict):
+            return json_response({"error": "No JSON body"}, 400)
+        try:
+            image = base64.b64decode(data.get("image_base64") or "", validate=True)
+        except ValueError:
+            return json_response({"error": "Invalid image_base64"}, 400)
 
-    # Add a server-side ID and timestamp
+    # Add a server-side ID and timestamp (Redis keeps IDs unique across processes)
+    if redis_client is None:
+        entry_id = next_entry_id()
+    else:
+        try:
+            entry_id = redis_client.incr(REDIS_ID_KEY)
+        except redis.RedisError as e:
+            return json_response({"error": f"Redis unavailable: {e}"}, 503)
+    analysis = data.get("analysis") or {}
     entry = {
-        "id": len(analysis_history) + 1,
+        "id": entry_id,
         "image_name": data.get("image_name", "unknown"),
-        "image_base64": data.get("image_base64", ""),
+        "image_url": f"/api/image/{entry_id}?v={BOOT_ID}" if image else None,
         "timestamp": data.get("timestamp", datetime.now().isoformat()),
-        "analysis": data.get("analysis", {}),
+        # Flat copy of the overall risk so summaries needn't walk `analysis`
+        "risk": (analysis.get("risk_assessment") or {}).get("overall_risk", "N/A"),
+        "analysis": analysis,
     }
 
-    with history_lock:
-        analysis_history.append(entry)
-
-    # Broadcast to SSE clients
-    broadcast_event(entry)
+    if redis_client is None:
+        _ingest(entry, image)
+    else:
+        # Every process, including this one, ingests it from the channel
+        try:
+            redis_client.publish(REDIS_CHANNEL, _pack_event(entry, image))
+        except redis.RedisError as e:
+            return json_response({"error": f"Redis unavailable: {e}"}, 503)
 
-    risk = entry["analysis"].get("risk_assessment", {}).get("overall_risk", "N/A")
-    print(f"[DASHBOARD] Received analysis #{entry['id']}: {entry['image_name']} (risk: {risk})")
+    logger.info("Received analysis #%d: %s (risk: %s)", entry["id"], entry["image_name"], entry["risk"])
 
-    return jsonify({"status": "ok", "id": entry["id"]}), 200
+    return json_response({"status": "ok", "id": entry["id"]}, 200)
 
 
 @app.route("/stream")
 def stream():
     """SSE endpoint – streams new analysis results to the browser."""
     def event_stream():
-        q = queue.Queue(maxsize=100)
-        with sse_clients_lock:
-            sse_clients.append(q)
+        q = SPSCRing(128)
+        clients, lock = _assign_shard()
+        with lock:
+            clients.add(q)
         try:
-            # Send a heartbeat so the browser knows the connection is alive
-            yield "data: {\"type\": \"connected\"}\n\n"
+            # Send a heartbeat so the browser knows the connection is alive,
+            # plus an immediate keep-alive so the response starts flushing
+            yield SUBSCRIBED_MSG
             while True:
                 try:
-                    message = q.get(timeout=30)
+                    message = q.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                    if message is None:
+                        # Evicted as too slow; ending the response makes the
+                        # browser's EventSource reconnect with a fresh queue
+                        break
                     yield message
                 except queue.Empty:
                     # Send keep-alive comment to prevent timeout
-                    yield ": keepalive\n\n"
-        except GeneratorExit:
+                    yield KEEPALIVE_MSG
+        except (GeneratorExit, BrokenPipeError, ConnectionResetError):
+            # Client went away; the finally below frees its queue
             pass
         finally:
-            with sse_clients_lock:
-                if q in sse_clients:
-                    sse_clients.remove(q)
+            with lock:
+                clients.discard(q)
 
-    return Response(
-        event_stream(),
-        mimetype="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-            "Connection": "keep-alive",
-        },
-    )
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        "Connection": "keep-alive",
+        "Vary": "Accept-Encoding",
+    }
+    body = event_stream()
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        body = gzip_stream(body)
+
+    return Response(body, mimetype="text/event-stream", headers=headers)
+
+
+@app.route("/api/image/<int:image_id>")
+def get_image(image_id):
+    """Return the JPEG for a history entry."""
+    with history_lock:
+        data = images.get(image_id)
+    if data is None:
+        return json_response({"error": "Image not found"}, 404)
+    # Only versioned URLs (as handed out in entries) are safe to cache
+    max_age = 3600 if request.args.get("v") else 0
+    return send_file(io.BytesIO(data), mimetype="image/jpeg", max_age=max_age)
+
+
+SUMMARY_FIELDS = ("id", "image_name", "timestamp", "risk")
 
 
 @app.route("/api/history")
 def history():
-    """Return all past analysis results (for initial page load)."""
-    with history_lock:
-        return jsonify(analysis_history)
+    """Return recent analysis results (for initial page load).
 
+    With ``?fields=summary`` only ``id``, ``image_name``, ``timestamp`` and
+    ``risk`` are returned per entry.
+    """
+    # Snapshot under the lock; serialize after releasing it so POSTs aren't blocked
+    with history_lock:
+        snapshot = list(analysis_history)
+    if request.args.get("fields") == "summary":
+        snapshot = [{key: entry[key] for key in SUMMARY_FIELDS} for entry in snapshot]
 
-# ---------------------------------------------------------------------------
-# Main
-# ---------------------------------------------------------------------------
+    def generate():
+        # One entry at a time, so the full JSON document is never held in memory
+        yield b"["
+        for i, entry in enumerate(snapshot):
+            if i:
+                yield b","
+            yield _json_dumps(entry)
+        yield b"]"
 
-if __name__ == "__main__":
-    print("=" * 60)
-    print("  Structural Inspection Dashboard")
-    print("  http://localhost:5000")
-    print("=" * 60)
-    # threaded=True is needed for SSE to work with Flask dev server
-    app.run(host="0.0.0.0", port=5000, debug=False, threaded=True)
+    return Response(stream_with_context(generate()), mimetype="application/json")
@@ -0,0 +1,25 @@
+"""
+Gunicorn configuration for the dashboard (loaded automatically when
+gunicorn is started from this directory):
+
+    cd dashboard
+    gunicorn app:app
+
+The gevent worker serves each SSE connection from a lightweight greenlet
+instead of a dedicated OS thread. Gunicorn monkey-patches the standard
+library before importing app.py, so the per-client queue.Queue and
+threading.Lock used there become cooperative automatically.
+"""
+
+import os
+
+bind = "0.0.0.0:5000"
+worker_class = "gevent"
+worker_connections = 1000   # concurrent SSE clients per worker
+
+# Analysis history and SSE clients live in process memory, so without Redis
+# a single worker is required for every browser to see every result. With
+# REDIS_URL set, new results are shared through Redis pub/sub and
+# DASHBOARD_WORKERS processes can serve clients; history is still kept per
+# worker, so a worker that gunicorn restarts starts with an empty history.
+workers = int(os.environ.get("DASHBOARD_WORKERS", "1")) if os.environ.get("REDIS_URL") else 1
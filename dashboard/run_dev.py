@@ -0,0 +1,35 @@
+"""
+Development Server for the Dashboard
+====================================
+Runs app.py on Flask's built-in server, re-launching itself under the
+project venv first if needed. For production (or many SSE clients) use
+`gunicorn app:app` from this directory instead (see gunicorn.conf.py).
+
+Usage:
+    cd dashboard
+    python run_dev.py
+"""
+
+import sys
+import os
+
+# Bootstrap to use venv if not already active
+if sys.base_prefix == sys.prefix:
+    if os.name == 'nt':
+        venv_python = os.path.join(os.path.dirname(__file__), "..", "venv", "Scripts", "python.exe")
+    else:
+        venv_python = os.path.join(os.path.dirname(__file__), "..", "venv", "bin", "python")
+
+    if os.path.exists(venv_python):
+        os.execv(venv_python, [venv_python] + sys.argv)
+
+from app import app
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  Structural Inspection Dashboard")
+    print("  http://localhost:5000")
+    print("=" * 60)
+    # threaded=True is needed for SSE to work with Flask dev server
+    app.run(host="0.0.0.0", port=5000, debug=False, threaded=True)